@@ -400,6 +400,32 @@ def main():
     )
 
 
+    # NAME, DESCRIPTION and VERSION as a module, so that the package
+    # does not have to run meta.sh and exec its output, or parse its
+    # installed METADATA, on every invocation
+    meta_constants_py_file_path = os.path.join(
+        root_module_dir_path,
+        '_meta_constants.py'
+    )
+    meta_constants_py_str = textwrap.dedent(
+        f'''\
+        # Generated by _setup.py from meta.sh; do not edit
+
+        NAME        = {NAME!r}
+        DESCRIPTION = {DESCRIPTION!r}
+        VERSION     = {VERSION!r}
+        '''
+    )
+    update_if_needed(
+        file_path    = meta_constants_py_file_path,
+        new_file_str = meta_constants_py_str
+    )
+    add_line_if_needed(
+        file_path = gitignore_file_path,
+        line_str  = meta_constants_py_file_path + '\n'
+    )
+
+
     manifest_in_file_path = 'MANIFEST.in'
 
     manifest_in_str = ''
@@ -1,6 +1,5 @@
 import sys
-import os
-import importlib.metadata
+import importlib.resources
 import argparse
 
 from . import meta
@@ -8,29 +7,13 @@ from . import meta
 
 def main():
 
-    assert 'NAME' not in globals()
+    meta_dict = meta.get_meta_dict()
 
-    exec(meta.get_meta_str())
-
-    assert 'NAME' in globals()
-
-
-    this_file_path = __file__
-
-    assert '__main__.py' == os.path.basename(this_file_path)
-
-    package_module_dir_path = os.path.dirname(this_file_path)
-
-
-    metadata = None
-    try:
-        metadata = importlib.metadata.metadata(NAME)
-    except importlib.metadata.PackageNotFoundError:
-        pass
-
-    name    = metadata['Name']    if metadata else 'name_not_available'
-    summary = metadata['Summary'] if metadata else 'summary_not_available'
-    version = metadata['Version'] if metadata else 'version_not_available'
+    # The installed Name, Summary and Version are generated from the
+    # same meta.sh NAME, DESCRIPTION and VERSION
+    name    = meta_dict['NAME']
+    summary = meta_dict.get('DESCRIPTION', 'summary_not_available')
+    version = meta_dict.get('VERSION',     'version_not_available')
 
 
     arg_parser = argparse.ArgumentParser(
@@ -49,17 +32,9 @@ def main():
     args = arg_parser.parse_args()
 
 
-    data_dir_path = os.path.join(package_module_dir_path, 'data')
-
-    assert os.path.isdir(data_dir_path)
-
-    quote_file_path = os.path.join(data_dir_path, 'quote.txt')
-
-    assert os.path.isfile(quote_file_path)
-
-    with open(quote_file_path, 'r') as quote_file:
+    quote_file = importlib.resources.files(__package__) / 'data' / 'quote.txt'
 
-        quote_str = quote_file.read().strip()
+    quote_str = quote_file.read_text().strip()
 
     print(quote_str)
     
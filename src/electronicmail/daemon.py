@@ -0,0 +1,387 @@
+from __future__ import annotations
+
+import sys
+import os
+import socket # .socket
+              # .AF_UNIX
+import selectors # .DefaultSelector
+import time # .monotonic
+import json # .dumps
+            # .loads
+import pickle # .dumps
+              # .load
+import imaplib
+import typing # .Callable
+
+
+# The operations a client is allowed to forward to the daemon's
+# imaplib.IMAP4_SSL instance
+_OPS = frozenset({
+    'select',
+    'list',
+    'status',
+    'search',
+    'fetch',
+    'store',
+    'check',
+    'expunge',
+    'select_search_fetch'
+})
+
+# Servers may drop a session that has been idle for 30 minutes
+# (RFC 9051 Section 5.4), so a NOOP is sent after 25 idle minutes
+_NOOP_INTERVAL_SECONDS = 25 * 60
+
+# Request frames are read in pieces of _RECV_SIZE; a client whose frame
+# grows past _MAX_FRAME_SIZE without a newline is disconnected
+_RECV_SIZE = 65536
+_MAX_FRAME_SIZE = 1 << 20
+
+# How long a client may take to read its reply before it is disconnected
+_REPLY_TIMEOUT_SECONDS = 30
+
+
+class _KernelProxy:
+    """
+    Stand-in for an imaplib.IMAP4_SSL instance that forwards commands
+    to the daemon's connection over a Unix domain socket
+
+    Requests are sent as newline-terminated JSON frames of the form
+    {"op": <name>, "args": [...]}, and each reply is a pickled
+    (ok, value) pair, where value is either the (result, response)
+    pair returned by imaplib or, if ok is False, an error message.
+    """
+
+    def __init__(self : _KernelProxy, sock : socket.socket) -> _KernelProxy:
+
+        self._sock = sock
+        self._file = sock.makefile('rwb')
+
+    def close(self : _KernelProxy):
+
+        self._file.close()
+        self._sock.close()
+
+    def _call(self : _KernelProxy, op : str, *args):
+
+        assert op in _OPS, op
+
+        # JSON has no bytes type; IMAP arguments are ASCII
+        args = [
+            arg.decode('ascii') if isinstance(arg, bytes) else arg
+            for arg in args
+        ]
+
+        frame = json.dumps({'op': op, 'args': args}).encode('utf-8')
+
+        self._file.write(frame + b'\n')
+        self._file.flush()
+
+        ok, value = pickle.load(self._file)
+
+        if not ok:
+            raise imaplib.IMAP4.error(value)
+
+        return value
+
+    def select(self : _KernelProxy, mailbox='INBOX', readonly=False):
+        return self._call('select', mailbox, readonly)
+
+    def list(self : _KernelProxy, directory='""', pattern='*'):
+        return self._call('list', directory, pattern)
+
+    def status(self : _KernelProxy, mailbox, names):
+        return self._call('status', mailbox, names)
+
+    def search(self : _KernelProxy, charset, *criteria):
+        return self._call('search', charset, *criteria)
+
+    def fetch(self : _KernelProxy, message_set, message_parts):
+        return self._call('fetch', message_set, message_parts)
+
+    def store(self : _KernelProxy, message_set, command, flags):
+        return self._call('store', message_set, command, flags)
+
+    def check(self : _KernelProxy):
+        return self._call('check')
+
+    def expunge(self : _KernelProxy):
+        return self._call('expunge')
+
+    def select_search_fetch(
+        self          : _KernelProxy,
+        mailbox,
+        criteria,
+        message_set,
+        message_parts
+    ):
+        return self._call(
+            'select_search_fetch',
+            mailbox,
+            criteria,
+            message_set,
+            message_parts
+        )
+
+
+def connect(sock_file_path : str) -> _KernelProxy | None:
+    """
+    Connect to a running daemon; return None if no daemon is listening
+    on sock_file_path
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(sock_file_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+
+    return _KernelProxy(sock=sock)
+
+
+def _shutdown(kernel : imaplib.IMAP4 | None) -> None:
+    """
+    Close the socket of a connection that is being dropped; the server
+    may already have closed its end
+    """
+
+    if None == kernel:
+        return
+
+    try:
+        kernel.shutdown()
+    except OSError:
+        pass
+
+
+def _close(selector : selectors.BaseSelector, conn : socket.socket) -> None:
+
+    selector.unregister(conn)
+
+    conn.close()
+
+
+def _serve(
+    listen_sock  : socket.socket,
+    connect_imap : typing.Callable[[], imaplib.IMAP4]
+) -> None:
+
+    kernel = None
+
+    last_use_time = time.monotonic()
+
+    selector = selectors.DefaultSelector()
+
+    selector.register(listen_sock, selectors.EVENT_READ)
+
+    while True:
+
+        timeout = _NOOP_INTERVAL_SECONDS - (time.monotonic() - last_use_time)
+
+        events = selector.select(timeout=max(timeout, 0))
+
+        if 0 == len(events):
+
+            if None != kernel:
+
+                try:
+                    kernel.noop()
+                except (imaplib.IMAP4.error, OSError):
+                    _shutdown(kernel)
+                    kernel = None
+
+            last_use_time = time.monotonic()
+
+            continue
+
+        for key, _ in events:
+
+            if key.fileobj is listen_sock:
+
+                conn, _ = listen_sock.accept()
+
+                # Reads never block, so that a client that stalls in the
+                # middle of a frame holds up no one else; data is the
+                # connection's buffer of bytes not yet ending a frame
+                conn.setblocking(False)
+
+                selector.register(conn, selectors.EVENT_READ, data=bytearray())
+
+                continue
+
+            conn = key.fileobj
+            buffer = key.data
+
+            try:
+                chunk = conn.recv(_RECV_SIZE)
+            except BlockingIOError:
+                continue
+            except OSError:
+                chunk = b''
+
+            if 0 == len(chunk):
+                _close(selector, conn)
+                continue
+
+            buffer += chunk
+
+            if _MAX_FRAME_SIZE < len(buffer) and b'\n' not in buffer:
+                _close(selector, conn)
+                continue
+
+            while b'\n' in buffer:
+
+                frame, _, rest = bytes(buffer).partition(b'\n')
+
+                buffer[:] = rest
+
+                kernel, reply = _handle_frame(
+                    frame        = frame,
+                    kernel       = kernel,
+                    connect_imap = connect_imap
+                )
+
+                last_use_time = time.monotonic()
+
+                # A reply may be larger than the socket buffer; the write
+                # blocks, but only up to _REPLY_TIMEOUT_SECONDS
+                try:
+                    conn.settimeout(_REPLY_TIMEOUT_SECONDS)
+                    conn.sendall(pickle.dumps(reply))
+                    conn.setblocking(False)
+
+                except OSError:
+
+                    # The client went away before reading its reply, e.g.
+                    # on Ctrl-C during a slow FETCH, or stopped reading
+
+                    _close(selector, conn)
+
+                    break
+
+
+def _handle_frame(
+    frame        : bytes,
+    kernel       : imaplib.IMAP4 | None,
+    connect_imap : typing.Callable[[], imaplib.IMAP4]
+) -> tuple:
+    """
+    Run the request in frame; return the connection to use for the next
+    request, which is None if it had to be dropped, and the reply
+    """
+
+    try:
+        request = json.loads(frame)
+
+        assert request['op'] in _OPS, request['op']
+
+        if None == kernel:
+            kernel = connect_imap()
+
+        reply = (True, getattr(kernel, request['op'])(*request['args']))
+
+    except (imaplib.IMAP4.abort, OSError) as e:
+
+        # The connection is lost or in an unknown state; drop it and
+        # reconnect on the next request
+
+        _shutdown(kernel)
+
+        kernel = None
+
+        reply = (False, f'{type(e).__name__}: {e}')
+
+    except imaplib.IMAP4.error as e:
+
+        # A tagged NO or BAD, e.g. a mistyped FETCH item; the
+        # connection, and the mailbox selected on it, are fine
+
+        reply = (False, f'{type(e).__name__}: {e}')
+
+    except (ValueError, KeyError, TypeError, AssertionError) as e:
+
+        reply = (False, f'malformed request: {e!r}')
+
+    except Exception as e:
+
+        # A request must never take the daemon, and with it the
+        # connection shared by every client, down
+
+        reply = (False, f'{type(e).__name__}: {e}')
+
+    return kernel, reply
+
+
+def start(
+    sock_file_path : str,
+    connect_imap   : typing.Callable[[], imaplib.IMAP4]
+) -> int:
+    """
+    Bind sock_file_path and detach a daemon that serves it
+
+    connect_imap is called by the daemon, on first use and after any error,
+    to obtain an authenticated imaplib.IMAP4 instance.
+    """
+
+    probe = connect(sock_file_path)
+
+    if None != probe:
+
+        probe.close()
+
+        sys.stderr.write(f'daemon already listening on {sock_file_path}\n')
+
+        return 1
+
+    if os.path.exists(sock_file_path):
+
+        # Left behind by a daemon that is no longer running
+        os.unlink(sock_file_path)
+
+    listen_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    umask = os.umask(0o177)
+    try:
+        listen_sock.bind(sock_file_path)
+    finally:
+        os.umask(umask)
+
+    os.chmod(sock_file_path, mode=0o600)
+
+    listen_sock.listen()
+
+    pid = os.fork()
+
+    if 0 < pid:
+
+        listen_sock.close()
+
+        wait_pid, retcode_raw = os.waitpid(pid, 0)
+
+        assert wait_pid == pid
+
+        print(f'daemon listening on {sock_file_path}')
+
+        return 0
+
+    assert 0 == pid
+
+    os.setsid()
+
+    if 0 < os.fork():
+        os._exit(0)
+
+    devnull_fd = os.open(os.devnull, os.O_RDWR)
+
+    for fd in [0, 1, 2]:
+        os.dup2(devnull_fd, fd)
+
+    os.close(devnull_fd)
+
+    try:
+        _serve(listen_sock=listen_sock, connect_imap=connect_imap)
+    finally:
+        os.unlink(sock_file_path)
+        os._exit(0)
@@ -2,25 +2,547 @@ from __future__ import annotations
 
 import sys
 import os
-import importlib.metadata
 import argparse
 import textwrap
-import getpass # .getuser
-import copy # .deepcopy
 import json # .dump
-            # .load
-import ssl # .create_default_context
-import pprint # .pprint
-import email.parser # .BytesParser
-                    #             .parsebytes
-import email.message # .Message
+            # .loads
+import ssl # .SSLContext
+import stat # .S_IMODE
+import email.parser # .BytesFeedParser
+import email.message # .EmailMessage
 import email.header # .decode_header
+                    # .make_header
 import email.policy # .default
+import email.errors # .HeaderParseError
 import imaplib
+import re # .compile
+import shlex # .split
+import hashlib # .sha1
+import time # .time
+import base64 # .b64decode
+import binascii # .Error
+import quopri # .decodestring
+import array # .array
+import importlib.resources # .files
+import codecs # .lookup
+import io # .RawIOBase
+        # .BufferedReader
+import zlib # .compressobj
+            # .decompressobj
+
+from . import meta # .get_meta_dict
+from . import daemon # .connect
+                     # .start
+
+
+# $HOME rather than /home/<user>, which is wrong on macOS and in many
+# containers; expanduser falls back to the password database
+_HOME_DIR_PATH = os.environ.get('HOME') or os.path.expanduser('~')
+
+_CONF_DIR_PATH = os.path.join(_HOME_DIR_PATH, '.electronicmail')
+
+# Untagged LIST response, e.g.
+#
+#   (\HasNoChildren \Marked) "/" "INBOX"
+#
+_LIST_RESPONSE_RE = re.compile(rb'^\(([^)]*)\) "([^"]*)" "(.*)"$')
+
+# RFC 2047 encoded word, e.g. =?utf-8?B?w6lsw6k=?=
+_RFC2047_ENCODED_WORD_RE = re.compile(r'=\?([^?]+)\?([bBqQ])\?([^?]*)\?=')
+
+# Shared by all connections so that a later connection can resume the
+# TLS session of an earlier one; certificates are not verified, so no
+# CA store is loaded
+_SSL_CONTEXT = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+_SSL_CONTEXT.check_hostname = False
+_SSL_CONTEXT.verify_mode = ssl.CERT_NONE
+_SSL_CONTEXT.options |= ssl.OP_NO_COMPRESSION
+
+# Shifted (non-ASCII) section of a modified UTF-7 mailbox name
+_MODIFIED_BASE64_RE = re.compile(r'&([A-Za-z0-9+,]*)-')
+
+# FETCH data items used on every header listing, encoded once; imaplib
+# sends bytes arguments as they are
+#
+# Listings only show the four fields below, so only those are requested
+# (RFC 9051 Section 6.4.5, BODY[<section>] with HEADER.FIELDS) rather
+# than the whole header block; the full header is fetched only when all
+# of its field names are to be printed
+_FETCH_FLAGS               = b'(FLAGS)'
+_FETCH_HEADER              = b'(RFC822.HEADER)'
+_FETCH_HEADER_FIELDS       = b'(BODY.PEEK[HEADER.FIELDS (TO FROM SUBJECT DATE)])'
+_FETCH_FLAGS_HEADER_FIELDS = b'(FLAGS BODY.PEEK[HEADER.FIELDS (TO FROM SUBJECT DATE)])'
+
+# Size of the slices in which raw messages are fed to the parser
+_FEED_SLICE_SIZE = 65536
+
+# Policy of every parsed message, looked up once
+_POLICY = email.policy.default
+
+# Status data items defined in RFC 9051 Section 6.3.11
+_STATUS_DATA_ITEM_NAMES = frozenset({
+    'MESSAGES',
+    'UIDNEXT',
+    'UIDVALIDITY',
+    'UNSEEN',
+    'DELETED',
+    'SIZE'
+})
+
+# How long a cached LIST result is used before the server is asked again
+_LIST_CACHE_TTL_SECONDS = 300
+
+
+def _lazy_bs4():
+    """
+    Import bs4 on first use; it is only needed to strip HTML bodies and
+    pulls in enough modules to slow down every other subcommand
+    """
+
+    import bs4 # .BeautifulSoup
+
+    return bs4
+
+
+def _parse_message(raw_email : bytes) -> email.message.EmailMessage:
+    """
+    Parse a raw RFC822 message by feeding it to the parser in slices
+
+    Before CPython 3.13 (gh-115512), email.message_from_bytes decodes
+    the whole message to str and copies it into a StringIO, whose
+    buffer takes up to four bytes per character, before parsing; a
+    message with large attachments peaks at several times its size.
+    BytesFeedParser decodes each slice on its own instead.
+    """
+
+    parser = email.parser.BytesFeedParser(policy=_POLICY)
+
+    raw_email_view = memoryview(raw_email)
+
+    for i in range(0, len(raw_email_view), _FEED_SLICE_SIZE):
+        parser.feed(bytes(raw_email_view[i:i+_FEED_SLICE_SIZE]))
+
+    return parser.close()
+
+
+def _payload_codec_name(charset : str | None) -> str:
+    """
+    Return the codec name of a text part's declared charset; a part
+    without one is ASCII (RFC 2046 Section 4.1.2), and an unknown one is
+    read as UTF-8
+    """
+
+    try:
+        return codecs.lookup(charset or 'us-ascii').name
+    except LookupError:
+        return 'utf-8'
+
+
+def _write_text_payload(payload : bytes, charset : str | None):
+    """
+    Write the payload of a text part to stdout, followed by a newline
+
+    When stdout already uses the payload's charset, the bytes are
+    written as they are instead of being decoded to a str that print
+    would encode straight back; otherwise the payload is decoded with
+    its own charset rather than assumed to be UTF-8.
+    """
+
+    payload_codec_name = _payload_codec_name(charset)
+
+    stdout_codec_name = codecs.lookup(sys.stdout.encoding).name
+
+    if (
+        payload_codec_name == stdout_codec_name
+        or ('ascii' == payload_codec_name and 'utf-8' == stdout_codec_name)
+    ):
+        sys.stdout.flush()
+        sys.stdout.buffer.write(payload)
+        sys.stdout.buffer.write(b'\n')
+        sys.stdout.buffer.flush()
+
+    else:
+        print(payload.decode(payload_codec_name, 'replace'))
+
+
+def _html_to_text(html : str) -> str:
+    """
+    Extract the text of an HTML body, parsing with the C-based lxml when
+    it is installed and with the pure-Python html.parser otherwise
+    """
+
+    bs4 = _lazy_bs4()
+
+    try:
+        soup = bs4.BeautifulSoup(html, 'lxml')
+    except bs4.FeatureNotFound:
+        soup = bs4.BeautifulSoup(html, 'html.parser')
+
+    return soup.get_text()
+
+
+def _iter_header_fields(header_bytes : bytes):
+    """
+    Yield the (name, value) pairs of an RFC 5322 header block, in order,
+    with folded values unfolded; scanning stops at the first empty line
+    """
+
+    name = None
+    value = None
+
+    for line in header_bytes.splitlines():
+
+        if 0 == len(line):
+            break
+
+        if line[:1] in (b' ', b'\t'):
+
+            # Continuation of a folded value
+            if None != name:
+                value += line
+
+            continue
+
+        if None != name:
+            yield name, value.strip()
+
+        name, colon, value = line.partition(b':')
+
+        if 0 == len(colon):
+
+            # Not a header field, e.g. an mbox "From " line
+            name = None
+
+    if None != name:
+        yield name, value.strip()
+
+
+def _decode_header_value(value : str) -> str:
+    """
+    Decode the RFC 2047 encoded words in a header value
+
+    A value that is exactly one encoded word, the usual case for an
+    encoded Subject, is decoded directly; anything else goes through
+    email.header.
+    """
+
+    m = _RFC2047_ENCODED_WORD_RE.fullmatch(value)
+
+    if None != m:
+
+        charset, encoding, encoded_text = m.groups()
+
+        try:
+            if 'b' == encoding.lower():
+                raw = base64.b64decode(encoded_text)
+            else:
+                raw = quopri.decodestring(
+                    encoded_text.encode('ascii'),
+                    header = True
+                )
+
+            return raw.decode(charset, 'replace')
+
+        except (binascii.Error, LookupError, UnicodeEncodeError):
+            pass
+
+    try:
+        chunks = email.header.decode_header(value)
+    except email.errors.HeaderParseError:
+        return value
+
+    try:
+        return str(email.header.make_header(chunks))
+
+    except (UnicodeDecodeError, LookupError):
+
+        # Undecodable bytes or an unknown charset; decode what can be
+        # decoded rather than lose the whole listing
+        decoded_chunks = list()
+
+        for chunk, charset in chunks:
+
+            if isinstance(chunk, str):
+                decoded_chunks.append(chunk)
+                continue
+
+            try:
+                decoded_chunks.append(chunk.decode(charset or 'ascii', 'replace'))
+            except LookupError:
+                decoded_chunks.append(chunk.decode('ascii', 'replace'))
+
+        return ''.join(decoded_chunks)
+
+
+def _parse_wanted_headers(header_bytes : bytes, wanted : set[bytes]) -> dict:
+    """
+    Map each lowercased header name in wanted that occurs in
+    header_bytes to its decoded str value
+
+    This is much cheaper than email.parser.BytesParser, which builds a
+    full message object for the whole header block.
+    """
+
+    headers = dict()
+
+    for name, value in _iter_header_fields(header_bytes):
+
+        name = name.strip().lower()
 
-import bs4 # .BeautifulSoup
+        if name not in wanted or name in headers:
+            continue
 
-from . import meta # .get_meta_str
+        value = value.decode('utf-8', 'replace')
+
+        if '=?' in value:
+
+            value = _decode_header_value(value)
+
+        headers[name] = value
+
+    return headers
+
+
+def _split_fetch_response(response : list) -> list[tuple[bytes, bytes]]:
+    """
+    Split the untagged FETCH responses returned by imaplib for a
+    multi-message FETCH into one (meta, literal) pair per message
+
+    imaplib returns each message as a (meta, literal) tuple followed by
+    a bytes item holding the rest of the response line, e.g.
+
+        (b'1 (FLAGS (\\Seen) RFC822.HEADER {342}', b'<headers>'), b')'
+
+    The rest of the line is appended to meta, so that data items the
+    server sends after the literal are not lost.
+    """
+
+    records = list()
+
+    record = None
+
+    for item in response:
+
+        if isinstance(item, tuple):
+
+            assert 2 == len(item)
+            assert isinstance(item[0], bytes)
+            assert isinstance(item[1], bytes)
+
+            if None != record:
+                records.append(record)
+
+            record = item
+
+        else:
+            assert isinstance(item, bytes), type(item)
+
+            if None != record:
+
+                records.append((record[0] + item, record[1]))
+
+                record = None
+
+    if None != record:
+        records.append(record)
+
+    return records
+
+
+def _parse_search_response(result : str, response : list) -> array.array:
+
+    assert result in ['OK', 'NO', 'BAD'], result
+    assert isinstance(response, list)
+
+    # One contiguous array of unsigned ints rather than a str object
+    # per message; IMAP message sequence numbers are 32-bit
+    message_numbers = array.array('I')
+
+    # A failed SEARCH, e.g. one pipelined after a failed SELECT, may
+    # come back as [None]
+    if 'OK' == result:
+
+        assert 1 == len(response)
+        assert isinstance(response[0], bytes)
+
+        message_numbers.extend(map(int, response[0].split()))
+
+    return message_numbers
+
+
+def _format_sequence_set(message_numbers : array.array) -> str:
+    """
+    Format ascending message numbers as an IMAP sequence set, with runs
+    collapsed into ranges, e.g. [1, 2, 3, 5, 7, 8] -> '1:3,5,7:8'; this
+    keeps the FETCH command short for large mailboxes
+    """
+
+    ranges = list()
+
+    first = None
+    last = None
+
+    for n in message_numbers:
+
+        if None != last and n == last + 1:
+            last = n
+            continue
+
+        if None != first:
+            ranges.append(f'{first}:{last}' if first != last else f'{first}')
+
+        first = n
+        last = n
+
+    if None != first:
+        ranges.append(f'{first}:{last}' if first != last else f'{first}')
+
+    return ','.join(ranges)
+
+
+def _format_headers(
+    header_bytes   : bytes,
+    print_all_keys : bool = False
+) -> list[str]:
+    """
+    Return the lines that _print_headers prints, without a trailing
+    newline, so that callers listing many messages can write them all
+    at once
+    """
+
+    headers = _parse_wanted_headers(
+        header_bytes = header_bytes,
+        wanted       = {b'to', b'from', b'subject', b'date'}
+    )
+
+    lines = [
+        f'  To      : {headers.get(b"to")}',
+        f'  From    : {headers.get(b"from")}',
+        f'  Subject : {headers.get(b"subject")}',
+        f'  Date    : {headers.get(b"date")}'
+    ]
+
+    if print_all_keys:
+        for name, _ in _iter_header_fields(header_bytes):
+            lines.append(name.decode('ascii', 'replace'))
+
+    return lines
+
+
+def _print_headers(header_bytes : bytes, print_all_keys : bool = False):
+
+    lines = _format_headers(
+        header_bytes   = header_bytes,
+        print_all_keys = print_all_keys
+    )
+
+    sys.stdout.write('\n'.join(lines) + '\n')
+
+
+def _decode_mailbox_name(name : bytes) -> str:
+    """
+    Decode a mailbox name in modified UTF-7 (RFC 3501 Section 5.1.3),
+    e.g. b'Entw&APw-rfe' -> 'Entwürfe'
+    """
+
+    def decode_shifted(m : re.Match) -> str:
+
+        if 0 == len(m.group(1)):
+            return '&'
+
+        try:
+            return f'+{m.group(1).replace(",", "/")}-'.encode('ascii').decode('utf-7')
+        except UnicodeDecodeError:
+            return m.group(0)
+
+    # Servers that accept UTF8=ACCEPT (RFC 6855) may send raw UTF-8
+    return _MODIFIED_BASE64_RE.sub(decode_shifted, name.decode('utf-8', 'replace'))
+
+
+def _read_list_cache(list_cache_file_path : str, key : str) -> list | None:
+    """
+    Return the mailboxes cached under key, or None if there is no entry
+    or the entry is older than _LIST_CACHE_TTL_SECONDS
+    """
+
+    try:
+        with open(list_cache_file_path, 'r') as list_cache_file:
+            cache_dict = json.load(fp=list_cache_file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    entry = cache_dict.get(key)
+
+    if None == entry or _LIST_CACHE_TTL_SECONDS <= time.time() - entry['ts']:
+        return None
+
+    return [
+        {
+            'name_attributes'     : {
+                a.encode('utf-8', 'surrogateescape')
+                for a in mb['name_attributes']
+            },
+            'hierarchy_delimiter' : \
+                mb['hierarchy_delimiter'].encode('utf-8', 'surrogateescape'),
+            'name'                : \
+                mb['name'].encode('utf-8', 'surrogateescape')
+        }
+        for mb in entry['mailboxes']
+    ]
+
+
+def _write_list_cache(
+    list_cache_file_path : str,
+    key                  : str,
+    mailboxes            : list
+):
+    """
+    Store mailboxes under key, dropping expired entries; the file is
+    replaced atomically so that readers never see a partial write
+    """
+
+    now = time.time()
+
+    try:
+        with open(list_cache_file_path, 'r') as list_cache_file:
+            cache_dict = json.load(fp=list_cache_file)
+    except (FileNotFoundError, ValueError):
+        cache_dict = dict()
+
+    cache_dict = {
+        k : entry
+        for k, entry in cache_dict.items()
+        if now - entry['ts'] < _LIST_CACHE_TTL_SECONDS
+    }
+
+    cache_dict[key] = {
+        'ts'        : now,
+        'mailboxes' : [
+            {
+                'name_attributes'     : sorted(
+                    a.decode('utf-8', 'surrogateescape')
+                    for a in mb['name_attributes']
+                ),
+                'hierarchy_delimiter' : \
+                    mb['hierarchy_delimiter'].decode('utf-8', 'surrogateescape'),
+                'name'                : \
+                    mb['name'].decode('utf-8', 'surrogateescape')
+            }
+            for mb in mailboxes
+        ]
+    }
+
+    tmp_file_path = f'{list_cache_file_path}.{os.getpid()}.tmp'
+
+    tmp_fd = os.open(
+        tmp_file_path,
+        os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+        0o600
+    )
+    with os.fdopen(tmp_fd, 'w') as tmp_file:
+        json.dump(obj=cache_dict, fp=tmp_file)
+
+    os.replace(tmp_file_path, list_cache_file_path)
 
 
 class _Conf:
@@ -35,13 +557,14 @@ class _Conf:
         'password' : 'password goes here'
     }
 
+    # (key, placeholder value) pairs that a configured file no longer has
+    _PLACEHOLDERS = frozenset(_CONF_DEFAULT_DICT.items())
+
     def __init__(self : _Conf) -> _Conf:
         
-        home_dir_path = f'/home/{getpass.getuser()}'
+        assert os.path.isdir(_HOME_DIR_PATH), _HOME_DIR_PATH
 
-        assert os.path.isdir(home_dir_path), home_dir_path
-
-        conf_dir_path = os.path.join(home_dir_path, '.electronicmail')
+        conf_dir_path = _CONF_DIR_PATH
 
         if not os.path.isdir(conf_dir_path):
 
@@ -49,47 +572,305 @@ class _Conf:
 
         conf_file_path = os.path.join(conf_dir_path, 'imap.json')
 
-        if not os.path.isfile(conf_file_path):
+        try:
+            conf_fd = os.open(conf_file_path, os.O_RDONLY | os.O_CLOEXEC)
 
-            conf_default_dict = copy.deepcopy(_Conf._CONF_DEFAULT_DICT)
+        except FileNotFoundError:
 
-            conf_file_obj = open(conf_file_path, mode='w')
+            conf_fd = os.open(
+                conf_file_path,
+                os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC,
+                0o600
+            )
+            with os.fdopen(conf_fd, 'w') as conf_file_obj:
+                json.dump(
+                    obj    = _Conf._CONF_DEFAULT_DICT,
+                    fp     = conf_file_obj,
+                    indent = 4
+                )
 
-            json.dump(obj=conf_default_dict, fp=conf_file_obj, indent=4)
+            conf_fd = os.open(conf_file_path, os.O_RDONLY | os.O_CLOEXEC)
 
-            conf_file_obj.close()
+        try:
+            conf_stat = os.fstat(conf_fd)
 
-        assert os.path.isfile(conf_file_path)
+            if 0o600 != stat.S_IMODE(conf_stat.st_mode):
 
-        os.chmod(path=conf_file_path, mode=0o600)
+                os.fchmod(conf_fd, 0o600)
 
-        conf_file_obj = open(conf_file_path, 'r')
+            conf_bytes = os.read(conf_fd, conf_stat.st_size)
 
-        conf_dict = json.load(fp=conf_file_obj)
+        finally:
+            os.close(conf_fd)
 
-        conf_file_obj.close()
+        conf_dict = json.loads(conf_bytes)
 
-        for key, value_default in _Conf._CONF_DEFAULT_DICT.items():
+        missing_keys = _Conf._CONF_DEFAULT_DICT.keys() - conf_dict.keys()
 
-            assert key in conf_dict, key
+        assert 0 == len(missing_keys), missing_keys
 
-            if conf_dict[key] == value_default:
+        for key, value_default in sorted(_Conf._PLACEHOLDERS & conf_dict.items()):
 
-                sys.stderr.write(
-                    textwrap.dedent(
-                        f'''\
-                        conf file path : {conf_file_path}
-                            please update default
-                            {key} : {value_default}
-                        '''
-                    )
+            sys.stderr.write(
+                textwrap.dedent(
+                    f'''\
+                    conf file path : {conf_file_path}
+                        please update default
+                        {key} : {value_default}
+                    '''
                 )
+            )
 
         self.host     = conf_dict['host']
         self.port     = conf_dict['port']
         self.user     = conf_dict['user']
         self.password = conf_dict['password']
 
+        self.sock_file_path = os.path.join(conf_dir_path, 'imap.sock')
+
+        self.list_cache_file_path = \
+            os.path.join(conf_dir_path, 'list_cache.json')
+
+
+class _InflateReader(io.RawIOBase):
+    """
+    Raw stream that inflates what it reads from file, a buffered
+    reader of a connection on which COMPRESS=DEFLATE is active
+
+    RFC 4978 Section 4 uses raw deflate (RFC 1951) without a zlib
+    header, hence the negative window size.
+    """
+
+    def __init__(self : _InflateReader, file : io.BufferedReader) -> _InflateReader:
+
+        self._file = file
+        self._inflate = zlib.decompressobj(-15)
+
+    def readable(self : _InflateReader) -> bool:
+        return True
+
+    def readinto(self : _InflateReader, buffer) -> int:
+
+        size = len(buffer)
+
+        while True:
+
+            # Input left over when the previous call filled its buffer
+            compressed = self._inflate.unconsumed_tail
+
+            if 0 == len(compressed):
+
+                # Whatever is available, without waiting for size bytes
+                compressed = self._file.read1(size)
+
+                if 0 == len(compressed):
+                    return 0
+
+            data = self._inflate.decompress(compressed, size)
+
+            # An incomplete deflate block yields nothing; read more
+            if 0 < len(data):
+                buffer[:len(data)] = data
+                return len(data)
+
+    def close(self : _InflateReader):
+
+        self._file.close()
+
+        super().close()
+
+
+class _Kernel(imaplib.IMAP4_SSL):
+    """
+    imaplib.IMAP4_SSL with a read buffer that holds a whole TLS record
+
+    imaplib reads each literal with a single file.read(size), but the
+    8 KiB buffer of the default socket.makefile takes two reads to drain
+    one 16 KiB TLS record; responses made of many small items, such as
+    a FETCH of many header blocks, pay for that on every record.
+    """
+
+    _READ_BUFFER_SIZE = 65536
+
+    # TLS session of the most recent connection, offered for resumption
+    # by the next one
+    _tls_session = None
+
+    # Compressor of outgoing data once COMPRESS=DEFLATE is active
+    _deflate = None
+
+    def _create_socket(self : _Kernel, timeout : float | None):
+        sock = imaplib.IMAP4._create_socket(self, timeout)
+        return self.ssl_context.wrap_socket(
+            sock,
+            server_hostname = self.host,
+            session         = _Kernel._tls_session
+        )
+
+    def open(
+        self    : _Kernel,
+        host    : str = '',
+        port    : int = imaplib.IMAP4_SSL_PORT,
+        timeout : float | None = None
+    ):
+        self.host = host
+        self.port = port
+        self.sock = self._create_socket(timeout)
+        self.file = self.sock.makefile(
+            'rb',
+            buffering = _Kernel._READ_BUFFER_SIZE
+        )
+
+    def send(self : _Kernel, data : bytes):
+
+        if None != self._deflate:
+
+            # Each command is flushed to a byte boundary so that the
+            # server can inflate all of it without waiting for more
+            data = (
+                self._deflate.compress(data)
+                + self._deflate.flush(zlib.Z_SYNC_FLUSH)
+            )
+
+        imaplib.IMAP4_SSL.send(self, data)
+
+    def compress_deflate(self : _Kernel):
+        """
+        Enable COMPRESS=DEFLATE (RFC 4978) on the connection
+
+        Literals such as header blocks and message bodies are mostly
+        text and typically shrink to a fraction of their size.
+        """
+
+        assert None == self._deflate
+
+        typ, dat = self.xatom('COMPRESS', 'DEFLATE')
+
+        if 'OK' != typ:
+            return typ, dat
+
+        # Everything the server sends after the tagged OK is compressed
+        self.file = io.BufferedReader(
+            _InflateReader(file=self.file),
+            buffer_size = _Kernel._READ_BUFFER_SIZE
+        )
+
+        self._deflate = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION,
+            zlib.DEFLATED,
+            -15
+        )
+
+        return typ, dat
+
+
+    def select_search_fetch(
+        self          : _Kernel,
+        mailbox       : str,
+        criteria      : list[str],
+        message_set   : str,
+        message_parts : str | bytes
+    ):
+        """
+        Send SELECT, SEARCH and FETCH back to back without waiting for
+        the tagged responses in between, then collect the three
+        (typ, data) results in order
+
+        The server runs pipelined commands in the order received, so
+        SEARCH and FETCH apply to the newly selected mailbox; the three
+        commands cost one round trip instead of three.
+        """
+
+        # As in imaplib.IMAP4.select
+        self.untagged_responses = {}
+        self.is_readonly = False
+
+        # imaplib checks each command against the connection state when
+        # it is sent, and SEARCH and FETCH go out before SELECT completes
+        self.state = 'SELECTED'
+
+        tags = [
+            ('SELECT', self._command('SELECT', mailbox)),
+            ('SEARCH', self._command('SEARCH', *criteria)),
+            ('FETCH',  self._command('FETCH', message_set, message_parts))
+        ]
+
+        results = list()
+
+        for name, tag in tags:
+
+            # Every tagged response must be read, even after a failure,
+            # so that the connection stays in step with the server
+            try:
+                typ, dat = self._command_complete(name, tag)
+            except self.abort:
+                raise
+            except self.error as e:
+                typ, dat = 'BAD', [str(e).encode('utf-8')]
+
+            if 'SELECT' == name:
+
+                if 'OK' != typ:
+                    self.state = 'AUTH'
+                    results.append((typ, dat))
+                else:
+                    results.append(
+                        (typ, self.untagged_responses.get('EXISTS', [None]))
+                    )
+
+            elif 'OK' != typ:
+
+                # _untagged_response would replace the server's error
+                # text with the (absent) untagged data
+                results.append((typ, dat))
+
+            else:
+                results.append(self._untagged_response(typ, dat, name))
+
+        return tuple(results)
+
+
+def _connect(conf : _Conf) -> _Kernel:
+    """
+    Open an authenticated connection to the IMAP server
+    """
+
+    print('#connect')
+    kernel = _Kernel(
+        host        = conf.host,
+        port        = conf.port,
+        ssl_context = _SSL_CONTEXT
+    )
+
+    print('#login')
+    print(
+        kernel.login(
+            user     = conf.user,
+            password = conf.password
+        )
+    )
+
+    # With TLS 1.3 the session ticket arrives after the handshake, so
+    # the session is captured once the LOGIN response has been read
+    _Kernel._tls_session = kernel.sock.session
+
+    # Many servers only advertise COMPRESS after authentication, in a
+    # CAPABILITY response code of the LOGIN reply or an untagged
+    # CAPABILITY; there is no separate CAPABILITY round trip
+    capabilities = set(kernel.capabilities)
+
+    for capability_bytes in kernel.untagged_responses.pop('CAPABILITY', []):
+        capabilities.update(
+            capability_bytes.decode('ascii', 'replace').upper().split()
+        )
+
+    if 'COMPRESS=DEFLATE' in capabilities:
+
+        print('#compress')
+        print(kernel.compress_deflate())
+
+    return kernel
+
 
 class Client:
     """
@@ -99,25 +880,17 @@ class Client:
     def __init__(self : Client) -> Client:
     
         self._conf = _Conf()
-        
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        
-        print('#connect')
-        self._kernel = imaplib.IMAP4_SSL(
-            host        = self._conf.host,
-            port        = self._conf.port,
-            ssl_context = ssl_context
-        )
 
-        print('#login')
-        print(
-            self._kernel.login(
-                user     = self._conf.user,
-                password = self._conf.password
-            )
-        )
+        # Reuse the connection held by a running daemon, if any, and
+        # skip the TLS handshake and LOGIN
+        self._kernel = daemon.connect(sock_file_path=self._conf.sock_file_path)
+
+        if None == self._kernel:
+
+            self._kernel = _connect(conf=self._conf)
+
+        else:
+            print(f'#daemon {self._conf.sock_file_path}')
 
     # =====
     # 6.3.1
@@ -196,166 +969,97 @@ class Client:
     def list(
         self                                 : Client,
         reference_name                       : str,
-        mailbox_name_with_possible_wildcards : str
+        mailbox_name_with_possible_wildcards : str,
+        force                                : bool = False
     ):
         """
-        Arguments:  reference name
-                    mailbox name with possible wildcards
-     
-        Responses:  untagged responses: LIST
-     
-        Result:     OK - list completed
-                    NO - list failure: can't list that reference or name
-                    BAD - command unknown or arguments invalid
-
-        The LIST command returns a subset of names from the complete set
-        of all names available to the client.  Zero or more untagged LIST
-        replies are returned, containing the name attributes, hierarchy
-        delimiter, and name; see the description of the LIST reply for
-        more detail.
-        """
-
-        """
-        List mailbox names in reference_name (a directory) that matches
-        mailbox_name_with_possible_wildcards (a pattern).
-        In order to list the contents of the top-level / root mail folder,
-        reference_name must be a str that contains two empty double quotes ('""')
-        """
-        result, responses = self._kernel.list(
-            directory = reference_name,                      # str
-            pattern   = mailbox_name_with_possible_wildcards # str
-        )
-        assert result in ['OK', 'NO', 'BAD'], result
-        assert isinstance(responses, list), type(responses)
-
-        mailboxes = list()
-
-        for resp in responses:
-
-            name_attributes = set()
-            hierarchy_delimeter = None
-            name = None
-
-            assert isinstance(resp, bytes)
-
-            i = 0
-            state = 'INIT'
-            
-            name_attribute_begin_index = None
-            hierarchy_delimiter_begin_index = None
-            name_begin_index = None
-
-            while True:
-
-                assert 0 <= i and i <= len(resp)
-
-                if 'INIT' == state:
-
-                    assert 0 == i
-                    assert b'(' == resp[i:i+1]
-
-                    state = 'READ_NAME_ATTRIBUTE_BEGIN'
-                    i = 1
-
-                elif 'READ_NAME_ATTRIBUTE_BEGIN' == state:
-
-                    assert 0 < i and i < len(resp)
-                    assert b'\\' == resp[i:i+1]
-
-                    assert None == name_attribute_begin_index
-                    name_attribute_begin_index = i
-
-                    state = 'READ_NAME_ATTRIBUTE_INSIDE'
-                    i += 1
-
-                elif 'READ_NAME_ATTRIBUTE_INSIDE' == state:
-
-                    assert 0 < i and i < len(resp)
-
-                    if resp[i:i+1] in [b' ', b')']:
-
-                        name_attr = resp[name_attribute_begin_index:i]
-
-                        assert name_attr not in name_attributes
-
-                        name_attributes.add(name_attr)
-
-                        name_attribute_begin_index = None
-
-                        if b' ' == resp[i:i+1]:
-
-                            state = 'READ_NAME_ATTRIBUTE_BEGIN'
-                            i += 1
-
-                        elif b')' == resp[i:i+1]:
-
-                            assert b' ' == resp[i+1:i+2]
-                            assert b'"' == resp[i+2:i+3]
-
-                            assert None == hierarchy_delimiter_begin_index
-                            hierarchy_delimiter_begin_index = i+3
-
-                            state = 'READ_HIERARCHY_DELIMITER_INSIDE'
-                            i += 3
-
-                    else:
-                        i += 1
-
-                elif 'READ_HIERARCHY_DELIMITER_INSIDE' == state:
-
-                    assert 0 < i and i < len(resp)
+        Arguments:  reference name
+                    mailbox name with possible wildcards
+     
+        Responses:  untagged responses: LIST
+     
+        Result:     OK - list completed
+                    NO - list failure: can't list that reference or name
+                    BAD - command unknown or arguments invalid
 
-                    if b'"' == resp[i:i+1]:
+        The LIST command returns a subset of names from the complete set
+        of all names available to the client.  Zero or more untagged LIST
+        replies are returned, containing the name attributes, hierarchy
+        delimiter, and name; see the description of the LIST reply for
+        more detail.
+        """
 
-                        assert b' ' == resp[i+1:i+2]
-                        assert b'"' == resp[i+2:i+3]
+        """
+        List mailbox names in reference_name (a directory) that matches
+        mailbox_name_with_possible_wildcards (a pattern).
+        In order to list the contents of the top-level / root mail folder,
+        reference_name must be a str that contains two empty double quotes ('""')
 
-                        assert None == hierarchy_delimeter
-                        hierarchy_delimiter = resp[hierarchy_delimiter_begin_index:i]
-                        hierarchy_delimiter_begin_index = None
+        The folder tree rarely changes, so an OK result is cached on disk
+        for _LIST_CACHE_TTL_SECONDS; pass force=True to bypass the cache.
+        """
+        list_cache_key = hashlib.sha1(
+            '|'.join([
+                self._conf.host,
+                self._conf.user,
+                reference_name,
+                mailbox_name_with_possible_wildcards
+            ]).encode('utf-8')
+        ).hexdigest()
+
+        if not force:
+
+            mailboxes = _read_list_cache(
+                list_cache_file_path = self._conf.list_cache_file_path,
+                key                  = list_cache_key
+            )
 
-                        assert None == name_begin_index
-                        name_begin_index = i+3
+            if None != mailboxes:
+                return 'OK', mailboxes
 
-                        state = 'READ_NAME_INSIDE'
-                        i += 3
+        result, responses = self._kernel.list(
+            directory = reference_name,                      # str
+            pattern   = mailbox_name_with_possible_wildcards # str
+        )
+        assert result in ['OK', 'NO', 'BAD'], result
+        assert isinstance(responses, list), type(responses)
 
-                    else:
-                        i += 1
+        mailboxes = list()
 
-                elif 'READ_NAME_INSIDE' == state:
+        for resp in responses:
 
-                    assert 0 < i and i < len(resp)
+            assert isinstance(resp, bytes)
 
-                    if b'"' == resp[i:i+1]:
+            m = _LIST_RESPONSE_RE.match(resp)
 
-                        assert i+1 == len(resp)
+            assert None != m, resp
 
-                        assert None == name
-                        name = resp[name_begin_index:i]
-                        name_begin_index = None
+            name_attributes_list = m.group(1).split()
 
-                        state = 'DONE'
-                        i += 1
+            name_attributes = set(name_attributes_list)
 
-                    else:
-                        i += 1
+            if __debug__:
 
-                elif 'DONE' == state:
+                assert len(name_attributes) == len(name_attributes_list), resp
 
-                    assert i == len(resp)
-                    break
+                for name_attr in name_attributes:
 
-            assert None == name_attribute_begin_index
-            assert None == hierarchy_delimiter_begin_index
-            assert None == name_begin_index
+                    assert b'\\' == name_attr[:1], resp
 
             mailboxes.append({
                 'name_attributes'     : name_attributes,
-                'hierarchy_delimiter' : hierarchy_delimiter,
-                'name'                : name
+                'hierarchy_delimiter' : m.group(2),
+                'name'                : m.group(3)
             })
 
+        if 'OK' == result:
+
+            _write_list_cache(
+                list_cache_file_path = self._conf.list_cache_file_path,
+                key                  = list_cache_key,
+                mailboxes            = mailboxes
+            )
+
         return result, mailboxes
 
 
@@ -454,19 +1158,10 @@ class Client:
         assert isinstance(mailbox_name, str)
         assert isinstance(status_data_item_names_list, list)
 
-        for name in status_data_item_names_list:
-            assert isinstance(name, str)
-            assert name in [
-                'MESSAGES',
-                'UIDNEXT'
-                'UIDVALIDITY',
-                'UNSEEN',
-                'DELETED',
-                'SIZE'
-            ]
+        unknown_names = set(status_data_item_names_list) - _STATUS_DATA_ITEM_NAMES
+        assert 0 == len(unknown_names), unknown_names
 
-        status_data_item_names_str = \
-            '(' + ' '.join(status_data_item_names_list) + ')'
+        status_data_item_names_str = f'({" ".join(status_data_item_names_list)})'
 
         result, response = self._kernel.status(
             mailbox = mailbox_name,
@@ -478,6 +1173,34 @@ class Client:
         return result, response
         
 
+    # ================
+    # 6.4.1 (RFC 3501)
+    # ================
+    #
+    # https://datatracker.ietf.org/doc/html/rfc3501#section-6.4.1
+    #
+    # https://docs.python.org/3/library/imaplib.html#imaplib.IMAP4.check
+    #
+    def check(self : Client):
+        """
+        Arguments:  none
+
+        Responses:  no specific responses for this command
+
+        Result:     OK - check completed
+                    BAD - command unknown or arguments invalid
+
+        The CHECK command requests a checkpoint of the currently selected
+        mailbox.  A checkpoint refers to any implementation-dependent
+        housekeeping associated with the mailbox (e.g., resolving the
+        server's in-memory state of the mailbox with the state on its
+        disk) that is not normally executed as part of each command.
+        """
+        result, responses = self._kernel.check()
+        assert result in ['OK', 'NO', 'BAD']
+        return result, responses
+
+
     # ================
     # 6.4.3 (RFC 9051)
     # ================
@@ -542,13 +1265,7 @@ class Client:
             optional_charset_specification,
             *one_or_more_searching_criteria
         )
-        assert result in ['OK', 'NO', 'BAD'], result
-        assert isinstance(response, list)
-        assert 1 == len(response)
-        assert isinstance(response[0], bytes)
-        message_numbers = response[0].decode('utf-8').split()
-
-        return result, message_numbers
+        return result, _parse_search_response(result, response)
 
 
     # =====
@@ -563,7 +1280,7 @@ class Client:
     def fetch(
         self                             : Client,
         sequence_set                     : str,
-        message_data_item_names_or_macro : str
+        message_data_item_names_or_macro : str | bytes
     ):
         """
         Arguments:  sequence set
@@ -590,25 +1307,24 @@ class Client:
         print(f'FETCH {sequence_set} (FLAGS)')
         result, response = self.fetch(
             sequence_set                     = sequence_set,
-            message_data_item_names_or_macro = '(FLAGS)'
+            message_data_item_names_or_macro = _FETCH_FLAGS
         )
         print(f'    result  : {result}')            
         print(f'    reponse : {response}')
         del result
         del response
         
-        print(f'FETCH {sequence_set} (RFC822.HEADER)')
+        if print_all_keys:
+            message_data_item_names_or_macro = _FETCH_HEADER
+        else:
+            message_data_item_names_or_macro = _FETCH_HEADER_FIELDS
+
+        print(f'FETCH {sequence_set} {message_data_item_names_or_macro.decode("ascii")}')
         result, untagged_responses = self.fetch(
             sequence_set                     = sequence_set,
-            message_data_item_names_or_macro = '(RFC822.HEADER)'
+            message_data_item_names_or_macro = message_data_item_names_or_macro
         )
     
-        #print(f'  result  : {result}')
-        #         Subject :
-    
-        bytes_parser = email.parser.BytesParser()
-    
-   
         assert isinstance(untagged_responses, list)
         assert 2 == len(untagged_responses)
     
@@ -622,37 +1338,80 @@ class Client:
         assert b')' == untagged_responses[1]
     
         header_bytes = untagged_responses[0][1]
+
+        _print_headers(
+            header_bytes   = header_bytes,
+            print_all_keys = print_all_keys
+        )
     
-        header_obj = bytes_parser.parsebytes(header_bytes, headersonly=True)
-    
-        # print(f'type(header_obj) : {type(header_obj)}')
-    
-        # for k in header_obj.keys():
-        #     print(k)
+        # import code
+        # code.interact(local=locals())
 
-        subject = header_obj['Subject']
 
-        if '=?' == subject[:2]:
+    def fetch_many(
+        self         : Client,
+        sequence_set : str,
+        items        : str | bytes
+    ):
+        """
+        FETCH items for every message in sequence_set with one command,
+        rather than one round trip per message
 
-            subject = email.header.decode_header(subject)
-    
-            subject = subject[0][0].decode(subject[0][1])
+        Returns the result and a list of (meta, literal) pairs, one per
+        message, where meta is the non-literal part of the response,
+        e.g. b'1 (FLAGS (\\Seen) RFC822.HEADER {342})', and literal is the
+        fetched data, e.g. the header block.
+        """
+        result, response = self.fetch(
+            sequence_set                     = sequence_set,
+            message_data_item_names_or_macro = items
+        )
+        assert result in ['OK', 'NO', 'BAD'], result
+        assert isinstance(response, list)
 
-        else:
-            pass
+        if 'OK' != result:
+            return result, response
 
-        print(f'  To      : {header_obj["To"]}')
-        print(f'  From    : {header_obj["From"]}')
-        #print(f'  Subject : {header_obj["Subject"]}')
-        print(f'  Subject : {subject}')
-        print(f'  Date    : {header_obj["Date"]}')
-    
-        if print_all_keys:
-            for k in header_obj.keys():
-                print(k)
-    
-        # import code
-        # code.interact(local=locals())
+        return result, _split_fetch_response(response)
+
+
+    def pipeline_select_search_fetch(
+        self                           : Client,
+        mailbox_name                   : str,
+        one_or_more_searching_criteria : list[str],
+        sequence_set                   : str,
+        items                          : str | bytes
+    ):
+        """
+        SELECT mailbox_name, SEARCH it, and FETCH items for sequence_set,
+        with the three commands pipelined into one round trip
+
+        The FETCH is sent before the SEARCH result is known, so
+        sequence_set cannot depend on it; '1:*' fetches every message.
+
+        Returns the select, search and fetch results, as returned by
+        select, search and fetch_many respectively.
+        """
+        select_pair, search_pair, fetch_pair = self._kernel.select_search_fetch(
+            mailbox       = mailbox_name,
+            criteria      = one_or_more_searching_criteria,
+            message_set   = sequence_set,
+            message_parts = items
+        )
+
+        search_result, search_response = search_pair
+
+        fetch_result, fetch_response = fetch_pair
+        assert fetch_result in ['OK', 'NO', 'BAD'], fetch_result
+
+        if 'OK' == fetch_result:
+            fetch_response = _split_fetch_response(fetch_response)
+
+        return (
+            select_pair,
+            (search_result, _parse_search_response(search_result, search_response)),
+            (fetch_result, fetch_response)
+        )
 
 
     # ================
@@ -695,158 +1454,163 @@ class Client:
         
 
 
-def _interact(args : argparse.Namespace) -> int:
-
-    connection = connect()
-    
-    while True:
-        command = input('imap> ')
-        
-        command_components = command.split()
-        
-
-        error = False
-        
-        if 0 == len(command_components):
-            
-            pass
-
-        else:
-            assert 0 < len(command_components)
-
-            cmd  = command_components[0]
-            args = command_components[1:]
-
-            # for i in range(len(args)):
-            #     if '""' == args[i]:
-            #         args[i] = ''
-            #     elif '"*"' == args[i]:
-            #         args[i] = '*'
-            for i in range(len(args)):
-                args[i] = args[i].replace('"', '')
-
-            print(f'cmd  : {cmd}')
-            print(f'args : {args}')
-
-            if 'list' == cmd:
+def _list(
+    client                               : Client,
+    reference_name                       : str,
+    mailbox_name_with_possible_wildcards : str
+):
+    result, mailboxes = client.list(
+        reference_name                       = reference_name,
+        mailbox_name_with_possible_wildcards = mailbox_name_with_possible_wildcards
+    )
+    print(f'    result : {result}')
+    for mb in mailboxes:
+        print(
+            f'    {_decode_mailbox_name(mb["name"])}',
+            mb['hierarchy_delimiter'],
+            mb['name_attributes']
+        )
 
-                if 2 != len(args):
 
-                    error = True
+def _status(client : Client, mailbox_name : str, *status_data_item_names : str):
+    result, response = client.status(
+        mailbox_name                = mailbox_name,
+        status_data_item_names_list = list(status_data_item_names)
+    )
+    print(f'    result   : {result}')
+    print(f'    response : {response}')
 
-                else:
 
-                    _list(
-                        imap                                 = imap,
-                        reference_name                       = args[0],
-                        mailbox_name_with_possible_wildcards = args[1]
-                    )
+def _search(client : Client, *one_or_more_searching_criteria : str):
+    result, message_numbers = client.search(
+        optional_charset_specification = None,
+        one_or_more_searching_criteria = list(one_or_more_searching_criteria)
+    )
+    print(f'    result          : {result}')
+    print(f'    message_numbers : {message_numbers.tolist()}')
 
-            elif 'status' == cmd:
 
-                if len(args) < 2:
-                    error = True
-                else:
-                    _status(
-                        imap                   = imap,
-                        mailbox_name           = args[0],
-                        status_data_item_names = args[1:]
-                    )
-            
-            elif 'search' == cmd:
+def _fetch(
+    client                           : Client,
+    sequence_set                     : str,
+    message_data_item_names_or_macro : str
+):
+    result, response = client.fetch(
+        sequence_set                     = sequence_set,
+        message_data_item_names_or_macro = message_data_item_names_or_macro
+    )
+    print(f'    result   : {result}')
+    print(f'    response : {response}')
+
+
+def _fetch_header(
+    client         : Client,
+    sequence_set   : str,
+    print_all_keys : bool = False
+):
+    client.fetch_and_print_headers(
+        sequence_set   = sequence_set,
+        print_all_keys = print_all_keys
+    )
 
-                if 0 == len(args):
-                    error = True
-                else:
-                    _search(
-                        imap                           = imap,
-                        optional_charset_specification = None,
-                        one_or_more_searching_criteria = args
-                    )
 
-            #elif 'uid' == cmd:
+def _fetch_header_keys(client : Client, sequence_set : str):
+    _fetch_header(
+        client         = client,
+        sequence_set   = sequence_set,
+        print_all_keys = True
+    )
 
-            #    if 0 == len(args):
-            #        error = True
-            #    else:
-            #        uid(client=client, args=args)
 
-            elif 'fetch' == cmd:
+def _select(client : Client, mailbox_name : str):
+    result, responses = client.select(mailbox_name=mailbox_name)
+    print(f'    result    : {result}')
+    print(f'    responses : {responses}')
+
+
+def _store(
+    client                      : Client,
+    sequence_set                : str,
+    message_data_item_name      : str,
+    value_for_message_data_item : str
+):
+    result, response = client.store(
+        sequence_set                = sequence_set,
+        message_data_item_name      = message_data_item_name,
+        value_for_message_data_item = value_for_message_data_item
+    )
+    print(f'    result   : {result}')
+    print(f'    response : {response}')
 
-                if 2 != len(args):
-                    error = True
-                else:
-                    _fetch(
-                        imap                             = imap,
-                        message_set                      = args[0],
-                        message_data_item_names_or_macro = args[1:]
-                    )
 
-            elif 'fetch-header' == cmd:
+def _check(client : Client):
+    result, responses = client.check()
+    print(f'    result    : {result}')
+    print(f'    responses : {responses}')
 
-                if 1 != len(args):
-                    error = True
-                else:
-                    _fetch_header(
-                        imap       = imap,
-                        message_id = args[0]
-                    )
 
-            elif 'fetch-header-keys' == cmd:
+def _expunge(client : Client):
+    result, responses = client.expunge()
+    print(f'    result    : {result}')
+    print(f'    responses : {responses}')
 
-                if 1 != len(args):
-                    error = True
-                else:
-                    _fetch_header(
-                        imap           = imap,
-                        message_id     = args[0],
-                        print_all_keys = True
-                    )
 
-            elif cmd in ['logout', 'q', 'quit', 'disconnect', 'exit']:
+# Commands of the interactive prompt:
+#
+#   command : (handler, number of arguments, whether more may follow)
+#
+_DISPATCH = {
+    'list'              : (_list,              2, False),
+    'status'            : (_status,            2, True ),
+    'search'            : (_search,            1, True ),
+    'fetch'             : (_fetch,             2, False),
+    'fetch-header'      : (_fetch_header,      1, False),
+    'fetch-header-keys' : (_fetch_header_keys, 1, False),
+    'select'            : (_select,            1, False),
+    'store'             : (_store,             3, False),
+    'check'             : (_check,             0, False),
+    'expunge'           : (_expunge,           0, False)
+}
 
-                break
+_QUIT_COMMANDS = frozenset({'logout', 'q', 'quit', 'disconnect', 'exit'})
 
-            elif 'select' == cmd:
 
-                if 1 != len(args):
-                    error = True
-                else:
-                    _select(
-                        imap         = imap,
-                        mailbox_name = args[0]
-                    )
+def _interact(args : argparse.Namespace) -> int:
 
-            elif 'store' == cmd:
+    client = Client()
+    
+    while True:
+        try:
+            command = input('imap> ')
+        except EOFError:
+            break
 
-                if 3 != len(args):
-                    error = True
-                else:
-                    _store(
-                        imap                        = imap,
-                        message_set                 = args[0],
-                        message_data_item_name      = args[1],
-                        value_for_message_data_item = args[2]
-                    )
+        # Quotes are kept (posix=False): imaplib sends arguments to the
+        # server verbatim, so '""' and '"My Folder"' must reach it quoted
+        try:
+            command_components = shlex.split(command, posix=False)
+        except ValueError:
+            command_components = None
 
-            elif 'check' == cmd:
+        if None != command_components and 0 == len(command_components):
+            continue
 
-                if 0 != len(args):
-                    error = True
-                else:
-                    _check(imap=imap)
+        error = None == command_components
 
-            elif 'expunge' == cmd:
+        if not error:
 
-                if 0 != len(args):
-                    error = True
-                else:
-                    _expunge(imap=imap)
+            cmd, *cmd_args = command_components
 
-            else:
-                error = True
+            if cmd in _QUIT_COMMANDS:
+                break
 
+            handler, arity, variadic = _DISPATCH.get(cmd, (None, 0, False))
 
+            error = (
+                None == handler
+                or (variadic and len(cmd_args) < arity)
+                or (not variadic and len(cmd_args) != arity)
+            )
 
         if error:
             print(
@@ -855,21 +1619,86 @@ def _interact(args : argparse.Namespace) -> int:
                     '{command}' is either an unrecognized command or was used improperly;
                       legal command usages are:
                          list <reference_name> <mailbox_name_with_possible_wildcards>
+                         status <folder> <status_data_item_name> [...]
+                         search <searching_criterion> [...]
+                         fetch <sequence_set> <message_data_item_names_or_macro>
+                         fetch-header <sequence_set>
+                         fetch-header-keys <sequence_set>
                          select <folder>
-                         status <folder>
-                         quit
-
-                    cmd  : {cmd}
-                    args : {args}'''
+                         store <sequence_set> <message_data_item_name> <value>
+                         check
+                         expunge
+                         quit'''
                 ),
                 file = sys.stderr
             )
+            continue
 
-
+        # A rejected command or bad arguments end only that command; a
+        # lost connection (IMAP4.abort) still ends the session
+        try:
+            handler(client, *cmd_args)
+        except imaplib.IMAP4.abort:
+            raise
+        except (imaplib.IMAP4.error, AssertionError) as e:
+            print(f'{cmd}: {type(e).__name__}: {e}', file=sys.stderr)
 
     return 0
 
 
+# Answers to the yes/no prompts of _test that count as yes, after
+# stripping and casefolding
+_YES = frozenset({'y', 'yes', 'true', '1'})
+
+
+def _fetch_and_print_all_headers(
+    client           : Client,
+    message_numbers  : array.array,
+    fetch_batch_size : int
+):
+    """
+    FETCH the headers of message_numbers with one command per
+    fetch_batch_size messages; some servers reject a single command
+    for thousands of messages as too long
+    """
+
+    assert 0 < fetch_batch_size, fetch_batch_size
+
+    for i in range(0, len(message_numbers), fetch_batch_size):
+
+        sequence_set = _format_sequence_set(
+            message_numbers[i:i+fetch_batch_size]
+        )
+
+        print(f'FETCH {sequence_set} {_FETCH_FLAGS_HEADER_FIELDS.decode("ascii")}')
+
+        result, records = client.fetch_many(
+            sequence_set = sequence_set,
+            items        = _FETCH_FLAGS_HEADER_FIELDS
+        )
+
+        _print_header_records(result=result, records=records)
+
+
+def _print_header_records(result : str, records : list):
+    """
+    Print a header listing with a single write, rather than with five
+    print calls per message
+    """
+
+    lines = [f'    result : {result}']
+
+    if 'OK' != result:
+        lines.append(f'    response : {records}')
+
+    else:
+        for meta_bytes, header_bytes in records:
+            lines.append(f'  {meta_bytes.decode("ascii", "replace")}')
+            lines.extend(_format_headers(header_bytes=header_bytes))
+
+    sys.stdout.write('\n'.join(lines) + '\n')
+
+
 def _test(args : argparse.Namespace) -> int:
     '''
     Check whether we can connect to the IMAP server and perform
@@ -888,23 +1717,43 @@ def _test(args : argparse.Namespace) -> int:
         reference_name                       = reference_name,
         mailbox_name_with_possible_wildcards = mailbox_name_with_possible_wildcards
     )
-    print(f'result         : {result}')
-    print(f'len(mailboxes) : {len(mailboxes)}')
-    
-    print('\n====')
+
+    # Each group of lines is written at once rather than with one
+    # print call per line, which flushes every line on a terminal
+    lines = [
+        f'result         : {result}',
+        f'len(mailboxes) : {len(mailboxes)}',
+        '',
+        '===='
+    ]
     for mb in mailboxes:
-        print('name :', ''.join([chr(b) for b in mb['name']]))
-        print('    attributes : ', mb['name_attributes'])
-        print('    delim      : ', mb['hierarchy_delimiter'])
-    print('====\n')
+        lines.append(f'name : {_decode_mailbox_name(mb["name"])}')
+        lines.append(f'    attributes :  {mb["name_attributes"]}')
+        lines.append(f'    delim      :  {mb["hierarchy_delimiter"]}')
+    lines.append('====')
+    lines.append('')
+
+    sys.stdout.write('\n'.join(lines) + '\n')
 
 
 
     mailbox_name = 'Spam'
 
+    # SELECT, SEARCH ALL and the header FETCH of every message in one
+    # round trip
+    (
+        (result, responses),
+        (search_result, message_numbers),
+        (fetch_result, records)
+    ) = client.pipeline_select_search_fetch(
+        mailbox_name                   = mailbox_name,
+        one_or_more_searching_criteria = ['ALL'],
+        sequence_set                   = '1:*',
+        items                          = _FETCH_FLAGS_HEADER_FIELDS
+    )
+
     print(f'SELECT {mailbox_name}')
 
-    result, responses = client.select(mailbox_name=mailbox_name)
     sys.stderr.write(
         textwrap.dedent(
             f'''\
@@ -914,45 +1763,55 @@ def _test(args : argparse.Namespace) -> int:
         )
     )
     
-    result, message_numbers = client.search(
-        optional_charset_specification = None,
-        one_or_more_searching_criteria = ['ALL']
-    )
-    
-    print()
-    print( 'SEARCH ALL')
-    print(f'    result          : {result}')
-    print(f'    message_numbers : {message_numbers}')
-    
-    for msg_num in message_numbers:
-        client.fetch_and_print_headers(
-            sequence_set   = msg_num,
-            print_all_keys = False
+    sys.stdout.write(
+        textwrap.dedent(
+            f'''
+            SEARCH ALL
+                result          : {search_result}
+                message_numbers : {message_numbers.tolist()}
+            FETCH 1:* {_FETCH_FLAGS_HEADER_FIELDS.decode("ascii")}
+            '''
         )
-    
+    )
 
-    delete_message = input('delete message with sequence number 1 (yes/no)? > ')
+    _print_header_records(result=fetch_result, records=records)
 
-    if 'yes' == delete_message:
+    # The rest of the test works on the first message
+    if 0 == len(message_numbers):
+        sys.stderr.write(f'no messages in {mailbox_name}\n')
+        return 1
+
+    # --delete/--no-delete and --print-body/--no-print-body answer the
+    # prompts up front, so that the test can run unattended
+    if None != args.delete:
+        delete_message = 'yes' if args.delete else 'no'
+    else:
+        delete_message = input('delete message with sequence number 1 (yes/no)? > ')
+
+    if delete_message.strip().casefold() in _YES:
 
         print('\nSTORE +FLAGS (\\Deleted)')
         result, response = client.store(
-            sequence_set                = message_numbers[0],
+            sequence_set                = str(message_numbers[0]),
             message_data_item_name      = '+FLAGS',
             value_for_message_data_item = '\\Deleted'
         )
-        print(f'    result   : {result}')
-        print(f'    response : {response}')
+        sys.stdout.write(
+            f'    result   : {result}\n'
+            f'    response : {response}\n'
+        )
 
         client.fetch_and_print_headers(
-            sequence_set   = message_numbers[0],
+            sequence_set   = str(message_numbers[0]),
             print_all_keys = False
         )
 
         print('\nEXPUNGE')
         result, responses = client.expunge()
-        print(f'    result    : {result}')
-        print(f'    responses : {responses}')
+        sys.stdout.write(
+            f'    result    : {result}\n'
+            f'    responses : {responses}\n'
+        )
 
 
         result, message_numbers = client.search(
@@ -960,24 +1819,45 @@ def _test(args : argparse.Namespace) -> int:
             one_or_more_searching_criteria = ['ALL']
         )
 
-        print()
-        print( 'SEARCH ALL')
-        print(f'    result          : {result}')
-        print(f'    message_numbers : {message_numbers}')
-        
-        for msg_num in message_numbers:
-            client.fetch_and_print_headers(
-                sequence_set   = msg_num,
-                print_all_keys = False
+        sys.stdout.write(
+            textwrap.dedent(
+                f'''
+                SEARCH ALL
+                    result          : {result}
+                    message_numbers : {message_numbers.tolist()}
+                '''
             )
+        )
+        
+        _fetch_and_print_all_headers(
+            client           = client,
+            message_numbers  = message_numbers,
+            fetch_batch_size = args.fetch_batch_size
+        )
     
     else:
         print(f'you entered "{delete_message}"; no delete')
 
 
+    if None != args.print_body:
+        print_email_body = 'yes' if args.print_body else 'no'
+    else:
+        print_email_body = input('print the email body (yes/no) > ')
+
+    # The message is only needed for its body; skip the FETCH otherwise
+    if print_email_body.strip().casefold() not in _YES:
+        print(f'you entered "{print_email_body}"; will not print email body')
+        return 0
+
+    # The SEARCH after an EXPUNGE finds nothing if the deleted message
+    # was the only one
+    if 0 == len(message_numbers):
+        sys.stderr.write(f'no messages left in {mailbox_name}\n')
+        return 1
+
     print(f'\nFETCH {message_numbers[0]} (RFC822)')
     result, response = client.fetch(
-        sequence_set                     = message_numbers[0],
+        sequence_set                     = str(message_numbers[0]),
         message_data_item_names_or_macro = '(RFC822)'
     )
     print(f'    result : {result}')
@@ -985,54 +1865,69 @@ def _test(args : argparse.Namespace) -> int:
     raw_email = response[0][1]
 
     # Parse the raw email into a Python object
-    email_message = email.message_from_bytes(
-        raw_email,
-        policy = email.policy.default
-    )
+    email_message = _parse_message(raw_email=raw_email)
     
     # Print the subject of the email
     print("Subject:", email_message['Subject'])
 
-    print_email_body = input('print the email body (yes/no) > ')
+    # If the email has multiple parts, iterate through them
+    if email_message.is_multipart():
+        # get_body looks through multipart/alternative and
+        # multipart/related for the plain text body, skipping
+        # attachments, attached messages (message/rfc822) included
+        body_part = email_message.get_body(preferencelist=('plain',))
+
+        if None != body_part:
+            print("Body:")
+            _write_text_payload(
+                payload = body_part.get_payload(decode=True),
+                charset = body_part.get_content_charset()
+            )
 
-    if 'yes' == print_email_body:
-    
-        # If the email has multiple parts, iterate through them
-        if email_message.is_multipart():
-            for part in email_message.iter_parts():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition"))
-        
-                # Extract the body
-                if content_type == "text/plain" and "attachment" not in content_disposition:
-                    body = part.get_payload(decode=True).decode()
-                    print("Body:", body)
-            
-            print('================================')
-            print('email message has MULTIPLE parts')
-        else:
-            # If the email is not multipart, just get the payload
-            body = email_message.get_payload(decode=True).decode()
+        sys.stdout.write(
+            '================================\n'
+            'email message has MULTIPLE parts\n'
+        )
+    else:
+        # If the email is not multipart, just get the payload
+        payload = email_message.get_payload(decode=True)
+        charset = email_message.get_content_charset()
 
-            if 'text/html' == email_message.get_content_type():
+        sys.stdout.write('Body\n====\n')
 
-                soup = bs4.BeautifulSoup(body, 'html.parser')
-                body = soup.get_text()
+        if 'text/html' == email_message.get_content_type():
 
-            print("Body")
-            print('====')
-            print(body)
+            body = _html_to_text(
+                payload.decode(_payload_codec_name(charset), 'replace')
+            )
 
-            print('==========================')
-            print('email message has ONE part')
+            sys.stdout.write(f'{body}\n')
 
-    else:
-        print(f'you entered "{print_email_body}"; will not print email body')
+        else:
+            _write_text_payload(payload=payload, charset=charset)
 
+        sys.stdout.write(
+            '==========================\n'
+            'email message has ONE part\n'
+        )
 
+    return 0
 
 
-    return 0
+def _positive_int(arg : str) -> int:
+    """
+    argparse type of options that must be a positive integer
+    """
+
+    try:
+        value = int(arg)
+    except ValueError:
+        value = 0
+
+    if 0 >= value:
+        raise argparse.ArgumentTypeError(f'not a positive integer: {arg!r}')
+
+    return value
 
 
 def _conf(args : argparse.Namespace) -> int:
@@ -1045,28 +1940,28 @@ def _conf(args : argparse.Namespace) -> int:
     return 0
 
 
-def _hello(args : argparse.Namespace) -> int:
+def _daemon(args : argparse.Namespace) -> int:
     '''
-    Print the hello world program to stdout.
+    Start a daemon that keeps one authenticated IMAP connection open
+    for subsequent invocations.
     '''
-    
-    this_file_path = __file__
-    
-    assert 'imap.py' == os.path.basename(this_file_path)
 
-    package_module_dir_path = os.path.dirname(this_file_path)
+    conf = _Conf()
 
-    data_dir_path = os.path.join(package_module_dir_path, 'data')
-
-    assert os.path.isdir(data_dir_path)
+    return daemon.start(
+        sock_file_path = conf.sock_file_path,
+        connect_imap   = lambda: _connect(conf=conf)
+    )
 
-    quote_file_path = os.path.join(data_dir_path, 'quote.txt')
 
-    assert os.path.isfile(quote_file_path)
+def _hello(args : argparse.Namespace) -> int:
+    '''
+    Print the hello world program to stdout.
+    '''
 
-    with open(quote_file_path, 'r') as quote_file:
+    quote_file = importlib.resources.files(__package__) / 'data' / 'quote.txt'
 
-        quote_str = quote_file.read().strip()
+    quote_str = quote_file.read_text().strip()
 
     print(quote_str)
 
@@ -1075,30 +1970,16 @@ def _hello(args : argparse.Namespace) -> int:
 
 def main() -> int:
 
-    assert 'NAME' not in globals()
-
-    exec(meta.get_meta_str())
-
-    assert 'NAME' in globals()
-
-    metadata = None
-    try:
-        metadata = importlib.metadata.metadata(NAME)
-    except importlib.metadata.PackageNotFoundError:
-        pass
-
-    name    = metadata['Name']    if metadata else 'name_not_available'
-    summary = metadata['Summary'] if metadata else 'summary_not_available'
-    version = metadata['Version'] if metadata else 'version_not_available'
+    meta_dict = meta.get_meta_dict()
 
-    assert NAME == name, \
-        textwrap.dedent(
-            f'''
-            NAME : {NAME}
-            name : {name}'''
-        )
+    # The installed Name, Summary and Version are generated from the
+    # same meta.sh NAME, DESCRIPTION and VERSION
+    name    = meta_dict['NAME']
+    summary = meta_dict.get('DESCRIPTION', 'summary_not_available')
+    version = meta_dict.get('VERSION',     'version_not_available')
 
-    assert 'electronicmail' == name
+    if 'electronicmail' != name:
+        raise RuntimeError(f'unexpected package name in meta.sh: {name}')
 
     name = f'{name}.imap'
 
@@ -1127,9 +2008,30 @@ def main() -> int:
 
     test_subparser = subparsers.add_parser('test')
     test_subparser.set_defaults(func=_test)
+    test_subparser.add_argument(
+        '--delete',
+        action  = argparse.BooleanOptionalAction,
+        default = None,
+        help    = 'delete the first message without prompting'
+    )
+    test_subparser.add_argument(
+        '--print-body',
+        action  = argparse.BooleanOptionalAction,
+        default = None,
+        help    = 'print the body of the first message without prompting'
+    )
+    test_subparser.add_argument(
+        '--fetch-batch-size',
+        type    = _positive_int,
+        default = 100,
+        help    = 'maximum number of messages per FETCH command'
+    )
 
     interact_subparser = subparsers.add_parser('interact')
     interact_subparser.set_defaults(func=_interact)
+
+    daemon_subparser = subparsers.add_parser('daemon')
+    daemon_subparser.set_defaults(func=_daemon)
     
     args = parser.parse_args()
 
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import os
 
 
@@ -45,18 +47,47 @@ def get_meta_str() -> str:
 
     assert 0 == retcode
 
-    meta_bytes = b''
+    meta_chunks = list()
     while True:
-        byte = os.read(pipefd[0], 1)
-        if 1 == len(byte):
-            meta_bytes += byte
+        chunk = os.read(pipefd[0], 65536)
+        if 0 < len(chunk):
+            meta_chunks.append(chunk)
         else:
-            assert 0 == len(byte)
+            assert 0 == len(chunk)
             break
 
-    meta_str = meta_bytes.decode('utf-8')
+    os.close(pipefd[0])
+
+    meta_str = b''.join(meta_chunks).decode('utf-8')
 
     return meta_str
 
 
+def get_meta_dict() -> dict:
+    """
+    Return the names meta.sh assigns, e.g. {'NAME': 'electronicmail', ...}
+
+    _setup.py writes NAME, DESCRIPTION and VERSION to _meta_constants.py,
+    which is imported like any other module; meta.sh is only run, and its
+    output exec-ed, in a checkout where _setup.py has not been run yet.
+    """
+
+    try:
+        from . import _meta_constants
+    except ImportError:
+        _meta_constants = None
+
+    if None != _meta_constants:
+        return {
+            'NAME'        : _meta_constants.NAME,
+            'DESCRIPTION' : _meta_constants.DESCRIPTION,
+            'VERSION'     : _meta_constants.VERSION
+        }
+
+    meta_dict = dict()
+
+    exec(get_meta_str(), dict(), meta_dict)
+
+    assert 'NAME' in meta_dict
 
+    return meta_dict